@@ -13,23 +13,40 @@
  # @link        https://github.com/jonsayer/qr-diskdrive
  ###############################################################################
 
+# cv2, pyzbar, zipfile and the reportlab PDF and style modules are slow to import, so they are imported inside the
+# functions that use them. That way saving to PNG, or just asking for --help, doesn't pay for them
 import qrcode
-import cv2
+import numpy as np
 import sys
 import argparse
 import time
-import math
 import shutil
 import io
-from pyzbar import pyzbar
-from base64     import b64encode, b64decode
-from os         import path,mkdir,rmdir,remove
-from binaryornot.check import is_binary
-from reportlab.pdfgen.canvas import Canvas
+import codecs
+import re
+import glob
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+# pybase64 is a much faster drop-in replacement for the standard base64 module. Use it if it is installed
+try:
+    from pybase64 import b64encode, b64decode
+except ImportError:
+    from base64 import b64encode, b64decode
+# segno is a faster pure python QR code generator than qrcode. Use it if it is installed, otherwise fall back to qrcode
+try:
+    import segno
+except ImportError:
+    segno = None
+# pyvips streams images in from disk instead of decoding the whole file up front, which keeps memory down on large decks of codes.
+# Use it if it is installed, otherwise fall back to cv2
+try:
+    import pyvips
+except ImportError:
+    pyvips = None
+from PIL import Image, ImageColor
+from os         import path,makedirs,remove,cpu_count
 from reportlab.lib.units import inch
-from reportlab.lib import utils as rl_utils
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import ParagraphStyle
 
 ################################################################################################################
                                         # Pre-set default variables
@@ -56,6 +73,9 @@ DEFAULT_BACK_COLOR = 'white'
 BORDER = 1
 # default error detection. H for security, L for capacity. Also M and Q but why even?
 DEBUG_LEVEL  = qrcode.constants.ERROR_CORRECT_L
+# mask pattern (0-7) used for every QR code. Picking the best mask means trying all 8, which is most of the work of
+# making a code, and any mask gives a valid code. None lets the qrcode library pick, which is the default for level H
+QR_MASK_PATTERN = 3
 #default folder that generated files are stored in, default is the same as the script
 DIRECTORY = ''
 # if true, the file is zipped before being encoded
@@ -86,22 +106,52 @@ PDF_CODE_ALIGN = 'left'
 PRINTER_DPI = 72 # We are assuming a **shitty** printer with 72 dpi
 # if the user wants to include the ascii text of the QR code on the page for some reason, we can also save .txt files to the directory for use that way. 
 PDF_INCLUDE_TXT = ''
-
-# set the text style for the PDF
-PARAGRAPH_STYLE = ParagraphStyle(
-    "text_output_style",
-    fontName="Times-Roman",  
-    fontSize=7,  
-    textColor='black'
-)
+# when scanning from the camera, only try to decode every this many frames
+CAMERA_DECODE_INTERVAL = 5
+# camera frames taller than this, in pixels, are scaled down before decoding
+CAMERA_MAX_DECODE_HEIGHT = 720
+
+# QR code versions we generate, and the most bytes each of them can hold below the next one, at error correction level L
+QR_VERSIONS = (5,10,15,20,25,30,35,40)
+QR_VERSION_CAPACITIES = (106,271,520,858,1273,1732,2303)
+# those capacities scaled for each error correction level, so getVersionFromChunk is a single lookup
+QR_VERSION_THRESHOLDS = {
+    qrcode.constants.ERROR_CORRECT_L: QR_VERSION_CAPACITIES,
+    qrcode.constants.ERROR_CORRECT_M: tuple(capacity*0.75 for capacity in QR_VERSION_CAPACITIES),
+    qrcode.constants.ERROR_CORRECT_H: tuple(capacity*0.4 for capacity in QR_VERSION_CAPACITIES),
+}
+# text of each QR code to print alongside it on a PDF, keyed by the code's file name, until it is drawn
+TEXT_CACHE = {}
+# the pyzbar module once getPyzbar has tried to import it, or False if it couldn't be. A failed import isn't cached by
+# python, and looking for the zbar library again costs about 10ms, which would add up over every camera frame
+PYZBAR = None
+# QRCode objects that saveQRcode has built, keyed by their settings, so they can be reused for the next chunk
+QR_CODE_CACHE = {}
+# segno names its error correction levels by letter
+SEGNO_LEVELS = {
+    qrcode.constants.ERROR_CORRECT_L: 'L',
+    qrcode.constants.ERROR_CORRECT_M: 'M',
+    qrcode.constants.ERROR_CORRECT_Q: 'Q',
+    qrcode.constants.ERROR_CORRECT_H: 'H',
+}
+
+# the text style for the PDF. reportlab's styles are slow to import, so getParagraphStyle builds it the first time
+# a PDF with text on it needs it
+PARAGRAPH_STYLE = None
 
 # class definition used in QR reading functions to 
 class qrCodeOutput:
     def __init__(self, isBinaryFile, outFileName, finalOutputString):
         self.isBinaryFile = isBinaryFile
         self.outFileName = outFileName
+        # list of the data, as bytes, from each QR code, in order
         self.finalOutputString = finalOutputString
 
+# a QR code found by decodeQRcodes, matching the .data attribute of the results pyzbar returns
+class decodedQRcode:
+    def __init__(self, data):
+        self.data = data
+
 ################################################################################################################
                                         # COMMAND AND CONTROL FUNCTIONS
 ################################################################################################################
@@ -123,6 +173,7 @@ def main():
     parser.add_argument("-b","--bytesize", type=int, help="Maximum size of each QR code, in bytes (max and default: 2953). Use one of the following for maximum capacity and scannability: 2953, 2303, 1732, 1273, 858, 520, 271, 106 ", action="store")
     parser.add_argument("-bd","--border", type=int, help="Width of the border around the generated QR code image, in the background color, measured in blocks.", action="store")
     parser.add_argument("-e","--errorcorrection", type=str, help="Error correction level in QR codes. Can use L, M or H  \n Default: L", action="store")
+    parser.add_argument("-m","--mask", type=str, help="Mask pattern used in the QR codes, 0 to 7, or 'auto' to have the best one picked for each code, which is much slower. Default: 3, or auto with error correction level H", action="store")
     parser.add_argument("-x","--pixeldensity", type=int, help="Width in pixels of a bit of saved QR code in a PNG. Default: 10", action="store")
     parser.add_argument("-f","--fillcolor", type=str, help="FILL COLOR, ie the dark color in the QR code. Use a basic color name eg. \'red\' or a hex code eg. #FFAABB.  Default: black", action="store")
     parser.add_argument("-w","--whitebackgroundcolor", type=str, help="BACK COLOR, ie the light color in the QR code.  \n Default: white", action="store")
@@ -224,6 +275,7 @@ def setDefaults(args):
     global BORDER
     global ZIP_FIRST
     global PDF_CODE_ALIGN
+    global QR_MASK_PATTERN
 
     if args.directory is not None:
         DIRECTORY = args.directory
@@ -274,6 +326,15 @@ def setDefaults(args):
             if CHUNK_SIZE > 1273:
                 CHUNK_SIZE = 1273
                 print('Setting bytesize to 1273 due to selecting error correction level H')
+            QR_MASK_PATTERN = None
+    if args.mask is not None:
+        if args.mask.lower() == 'auto':
+            QR_MASK_PATTERN = None
+        elif args.mask.isdigit() and int(args.mask) <= 7:
+            QR_MASK_PATTERN = int(args.mask)
+        else:
+            print('***Error*** Mask pattern must be a number from 0 to 7, or auto')
+            sys.exit()
 
 def customize(filename,outFileName):
     print('\n\nHit enter to use the default value on all options')
@@ -283,6 +344,7 @@ def customize(filename,outFileName):
     global DEFAULT_FILL_COLOR
     global DEBUG_LEVEL
     global DIRECTORY
+    global QR_MASK_PATTERN
     NEW_CHUNK_SIZE = int(input('\nCHUNK SIZE, ie max amount of data in each QR code, in bytes \n Default: 2900. Max: 2953 \n: ') or str(0))
     if bool(NEW_CHUNK_SIZE):
         CHUNK_SIZE = NEW_CHUNK_SIZE
@@ -306,6 +368,7 @@ def customize(filename,outFileName):
         DEBUG_LEVEL  = qrcode.constants.ERROR_CORRECT_H
         if CHUNK_SIZE > 1273:
             CHUNK_SIZE = 1273
+        QR_MASK_PATTERN = None
     NEW_DIRECTORY = input('\nDIRECTORY, ie folder to save files to.  \n Default: same as this script \n ')
     if NEW_DIRECTORY is not None:
         DIRECTORY = NEW_DIRECTORY
@@ -341,7 +404,7 @@ def saveMode(filename,pdfMode,zipMode,pagesize,preset_outFileName):
         preset_outFileName = path.basename(filename)
     else:
         preset_outFileName = preset_outFileName + getextension( path.basename(filename) )
-    # file is an array containing manageable chunks of the original file stored as text. 
+    # file is an array containing manageable chunks of the original file stored as ascii bytes. 
     file = getAndSplitFile(filename,CHUNK_SIZE,preset_outFileName)
     outputCount = len(file)
     continuing = input( '\nThat file would save as '+str(outputCount)+' QR code(s). Continue? Y/N  : ' )
@@ -349,50 +412,51 @@ def saveMode(filename,pdfMode,zipMode,pagesize,preset_outFileName):
         sys.exit("\nQuitting...")
     current = 0
     directory = ''
-    # PDF and Zipped QR codes will be stored in a temporary directory that we will delete at the end of the process
+    # PDF pages and zipped QR codes are made from the QR code images in memory, so they don't need a directory for them
     # Otherwise, output to the directory defined by the user
-    if pdfMode:
-        directory = 'TEMP_QR_HOLD'
-        if not path.exists(directory):
-            mkdir(directory)
-        directory = directory + '/'
-    elif zipMode:
-        directory = 'QR_'+preset_outFileName
-        if not path.exists(directory):
-            mkdir(directory)
-        directory = directory + '/'
-    elif DIRECTORY != '':
+    if DIRECTORY != '':
         directory = DIRECTORY
-        if not path.exists(directory):
-            mkdir(directory)
+        makedirs(directory, exist_ok=True)
         directory = directory+'/'
-    # Loop through the file array and make a QR code for each chunk of the file.
-    for blob in file:
-        outFileName = generateFileName(directory+preset_outFileName,current,outputCount)
-        data = blob
-        saveQRcode(outFileName,data,len(data),DEFAULT_FILL_COLOR,DEFAULT_BACK_COLOR,DEFAULT_PIXEL_DENSITY,DEBUG_LEVEL)
-        if pdfMode and PDF_INCLUDE_TXT:
-            # the user wants to include the ascii text of the QR code on the page of the PDF, so we will also cache that
-            saveDataAsTXT(preset_outFileName+'.'+str(current),data)
-        current = current + 1
-    # if generating a PDF, take the QR codes created and make it, then delete the cached QR codes
+    # Make a QR code for each chunk of the file. Each code is independent of the others, so when there is
+    # more than one they are rendered in parallel across all of the CPU cores
+    # For a PDF or zip file there are no file names, so saveQRcode hands back each image as PNG data instead
+    if pdfMode or zipMode:
+        outFileNames = [None] * outputCount
+    else:
+        outFileNames = [ generateFileName(directory+preset_outFileName,index,outputCount) for index in range(outputCount) ]
+    # every chunk but the last is the same size, so only look up the QR code version once per size
+    versionsBySize = { size: getVersionFromChunk(size,DEBUG_LEVEL) for size in set( len(blob) for blob in file ) }
+    qrVersions = [ versionsBySize[len(blob)] for blob in file ]
+    # PNGs for a PDF only carry the image to reportlab, which compresses it again, so go easy on the compression
+    compressLevel = 1 if pdfMode else 6
+    qrSettings = (repeat(DEFAULT_FILL_COLOR),repeat(DEFAULT_BACK_COLOR),repeat(DEFAULT_PIXEL_DENSITY),repeat(DEBUG_LEVEL),repeat(BORDER),repeat(QR_MASK_PATTERN),repeat(compressLevel))
+    if outputCount >= 2:
+        # hand the chunks out to the workers in batches, a few per core, rather than one round trip per code
+        workers = cpu_count() or 1
+        batchSize = max( 1, outputCount // (workers * 4) )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            qrImages = list( executor.map(saveQRcode,outFileNames,file,qrVersions,*qrSettings,chunksize=batchSize) )
+    else:
+        qrImages = list( map(saveQRcode,outFileNames,file,qrVersions,*qrSettings) )
+    if pdfMode and PDF_INCLUDE_TXT:
+        # the user wants to include the ascii text of the QR code on the page of the PDF, so we will also keep that
+        for blob in file:
+            TEXT_CACHE[preset_outFileName+'.'+str(current)] = blob.decode('utf-8')
+            current = current + 1
+    # if generating a PDF, take the QR codes created and make it
     if pdfMode:
-        generateQRpdf(directory,preset_outFileName,pagesize,outputCount)
-    # if generating a zip file, take the QR codes created and zip them, then delete the cached QR codes
+        from reportlab.lib.utils import ImageReader
+        qrImages = [ ImageReader(io.BytesIO(pngData)) for pngData in qrImages ]
+        generateQRpdf(qrImages,preset_outFileName,pagesize,outputCount)
+    # if generating a zip file, write the QR codes created straight into it
     # as written, you can't zip the pdf
     elif zipMode:
-        saveDir = ''
-        if DIRECTORY != '':
-            saveDir = DIRECTORY+'/'
-        shutil.make_archive(saveDir+preset_outFileName, 'zip', directory[:-1])
-    # delete the cached QR code PNG files used in the pdf or zip creation process
-    if pdfMode or zipMode:
-        index = 0
-        while index < outputCount:
-            if path.exists(generateFileName(directory+preset_outFileName,index,outputCount)):
-                remove(generateFileName(directory+preset_outFileName,index,outputCount))
-            index += 1
-        rmdir(directory[:len(directory)-1 ])
+        import zipfile
+        # deflating the PNGs again takes about 0.2ms a code and still makes the zip around 15% smaller, so it stays on
+        with zipfile.ZipFile(directory+preset_outFileName+'.zip', 'w', compression=zipfile.ZIP_DEFLATED) as zipFile:
+            for index, pngData in enumerate(qrImages):
+                zipFile.writestr(generateFileName(preset_outFileName,index,outputCount), pngData)
 
 
 # This function figures out what the CODE_WIDTH of the QR codes should be if output to a PDF, ie. the width in inches
@@ -475,16 +539,16 @@ def setPDFpageDimensionVars(pagesize):
         # there are some sizes of QR code too small for the box we are in
         # a QR codes version number starts at 1, 21 dts per side and goes up to 40. Each additional version is 4 more dots per side
         maxQRversion = (moduleWidth-21)/4
-        # get the QR code version our chunk would use
-        chunkQRversion = getVersionFromChunk(CHUNK_SIZE)
-        while chunkQRversion > maxQRversion or CHUNK_SIZE < 107: # the second parameter stops us from entering a forever loop if we reach the smallest size
-            # if we are in this position, it means that our chunk size is too big for the size of QR code we are outputting
-            # we need to reduce it
-            CHUNK_SIZE = reduceChunkSize(CHUNK_SIZE)
-            chunkQRversion = getVersionFromChunk(CHUNK_SIZE)
-        print('WARNING: Had to reduce the capacity of each QR code from '+str(chunkOriginal)+' to '+str(CHUNK_SIZE) +' because we are printing a smaller-sized QR code based on settings.')
+        # if the version our chunk would use is too big, drop straight to the most data that fits in the largest
+        # version we make that is small enough. If even the smallest is too big, that is the best we can do, but a
+        # bytesize that is already smaller than that is never raised
+        if getVersionFromChunk(CHUNK_SIZE) > maxQRversion:
+            versionIndex = max( bisect_right(QR_VERSIONS, maxQRversion) - 1, 0 )
+            CHUNK_SIZE = min( CHUNK_SIZE, int( QR_VERSION_THRESHOLDS.get(DEBUG_LEVEL, QR_VERSION_CAPACITIES)[versionIndex] ) )
+        if CHUNK_SIZE < chunkOriginal:
+            print('WARNING: Had to reduce the capacity of each QR code from '+str(chunkOriginal)+' to '+str(CHUNK_SIZE) +' because we are printing a smaller-sized QR code based on settings.')
         #if chunk size is changed, but the override flag is set, reset it back to what the user set it to originally
-        if CHUNK_SAFETY_OVERRIDE == True:
+        if CHUNK_SAFETY_OVERRIDE == True and CHUNK_SIZE != chunkOriginal:
             CHUNK_SIZE = chunkOriginal
             print('QR code capacity overridden because -y was set. Reset back to '+str(str(chunkOriginal)) +'. YOU HAVE BEEN WARNED!')
 
@@ -507,83 +571,132 @@ def getAndSplitFile(filename,chunkSize,preset_outFileName):
         filename = filename+'.zip'
         print('File compressed to zip.')
     
-    if is_binary( filename ):
-        print('This is a binary file. It\'s contents will be encoded in Base64 as ascii text in the QR code.')
-        BASE64ENCODE = True
-        readMethod = 'rb'
-    else:
-        with open(filename,'r') as f:
-            fullFile = f.read()
-            if(isAscii(fullFile)):
+    # the temporary zip file is removed even if splitting the file fails
+    try:
+        # the first 8kb are enough to tell whether this is binary data
+        with open(filename,'rb') as f:
+            BASE64ENCODE = isBinary( f.read(8192) )
+        if preset_outFileName == '' or preset_outFileName is None:
+            preset_outFileName = filename
+        fileHeader = b'::f::%b::/f::::c0::' % path.basename(preset_outFileName).encode('utf-8')
+        if BASE64ENCODE:
+            print('This is a binary file. It\'s contents will be encoded in Base64 as ascii text in the QR code.')
+        else:
+            try:
+                blobList = readFileInChunks(filename,chunkSize,fileHeader,False)
                 print('This is a text file and will be encoded directly into the QR code.')
-                BASE64ENCODE = False
-                readMethod = 'r'
-            else:
+            except UnicodeDecodeError:
                 print('Text file contains non-ascii chararacters, so it will be encoded as binary data.')
                 BASE64ENCODE = True
-                readMethod = 'rb'
-        
-    
-    #blobList will be an array of strings, each being the size we need for our QR codes. It will be returned.
-    blobList = []
-
-    with open(filename,readMethod) as f:
-        buffer = ''
-        if readMethod == 'r':
-            fullFile = f.read()
-        else:
-            binaryData = f.read()
-            fullFile = b64encode(binaryData)
-            fullFile = fullFile.decode('utf-8')
-            buffer = 'b64:'
+        if BASE64ENCODE:
+            buffer = b'b64:'
             if ZIP_FIRST:
                 #this flag will alert the decoder that this is a zip file and will need to be decompressed
-                buffer = buffer + ':z:'
-        if preset_outFileName == '' or preset_outFileName is None:
-            preset_outFileName = filename
-        buffer = buffer + '::f::' + path.basename(preset_outFileName) + '::/f::'
-        buffer = buffer + '::c0::'
-        byte = fullFile[0]
-        index = 0
-        while len( byte ):
-            buffer += byte
-            if len( buffer ) == chunkSize:
-                blobList.append( buffer )
-                index += 1
-                buffer = '::c'+str(index)+'::'
-            fullFile = fullFile[1:len(fullFile)]
-            if len(fullFile):
-                byte = fullFile[0]
-            else:
-                byte = ''
+                buffer = buffer + b':z:'
+            blobList = readFileInChunks(filename,chunkSize,buffer + fileHeader,True)
+    finally:
+        if ZIP_FIRST:
+            #remove the temporary zip file
+            remove(filename)
+    return blobList
 
-        if len( buffer ):
-            blobList.append( buffer )
-    if ZIP_FIRST:
-        #remove the temporary zip file
-        remove(filename)
+# Reads the file a piece at a time and returns a list of bytes, each being the size we need for our QR codes
+# Text files are read as ascii, which converts the line endings and raises UnicodeDecodeError on anything else
+# Binary files are read in multiples of 3 bytes, so each piece encodes to Base64 without padding
+def readFileInChunks(filename,chunkSize,buffer,base64encode):
+    blobList = []
+    index = 0
+    minimumRoom = 4 if base64encode else 1
+    if base64encode:
+        f = open(filename,'rb')
+    else:
+        f = open(filename,'r',encoding='ascii')
+    with f:
+        while True:
+            room = chunkSize - len( buffer )
+            # if the header fills the chunk, none of the file would ever fit in a QR code. Base64 needs room for at least
+            # one group of 4 characters
+            if room < minimumRoom:
+                print('***Error*** Bytesize '+str(chunkSize)+' is too small for the file name header ('+str(len(buffer))+' bytes). Use a larger bytesize or a shorter file name.')
+                exit( 1 )
+            if base64encode:
+                piece = b64encode( f.read( room // 4 * 3 ) )
+            else:
+                piece = f.read( room ).encode('ascii')
+            if not piece:
+                break
+            blobList.append( buffer + piece )
+            index += 1
+            buffer = b'::c%d::' % index
+    # an empty file still gets a QR code carrying its header
+    if not blobList:
+        blobList.append( buffer )
     return blobList
 
 # Main function for generating a QR code and saving it as a PNG file
-def saveQRcode(saveName,data,chunkSize,fillColor,backColor,pixelDensity,debugLevel):
-    theVersion=getVersionFromChunk(chunkSize)
-    if theVersion > 40:
-        theVersion = 40
-    qr = qrcode.QRCode(
-        version=theVersion,
-        error_correction=debugLevel,
-        box_size=pixelDensity,
-        border=BORDER,
-    )
+# If saveName is None, the PNG is not written to disk but returned as bytes instead
+# Everything it needs is passed in rather than read from the globals, because it may run in a worker process
+def saveQRcode(saveName,data,theVersion,fillColor,backColor,pixelDensity,debugLevel,border,maskPattern,compressLevel):
+    if segno is not None:
+        # boost_error would otherwise raise the error correction level whenever the data leaves room for it
+        qr = segno.make(data, error=SEGNO_LEVELS[debugLevel], version=theVersion, mode='byte', mask=maskPattern, boost_error=False)
+        matrix = np.pad( np.array(qr.matrix, dtype=bool), border )
+        img = renderQRmatrix(matrix,pixelDensity,fillColor,backColor)
+    else:
+        img = makeQRimage(data,theVersion,fillColor,backColor,pixelDensity,debugLevel,border,maskPattern)
+    if saveName is None:
+        pngData = io.BytesIO()
+        img.save(pngData, format='PNG', compress_level=compressLevel)
+        return pngData.getvalue()
+    img.save(saveName, compress_level=compressLevel)
+
+# builds the image of a QR code with the qrcode library
+def makeQRimage(data,theVersion,fillColor,backColor,pixelDensity,debugLevel,border,maskPattern):
+    # reuse the QRCode object from the last code with the same settings rather than building a new one for every chunk
+    qrSettings = (theVersion,debugLevel,pixelDensity,border,maskPattern)
+    qr = QR_CODE_CACHE.get(qrSettings)
+    if qr is None:
+        qr = qrcode.QRCode(
+            version=theVersion,
+            error_correction=debugLevel,
+            box_size=pixelDensity,
+            border=border,
+            mask_pattern=maskPattern,
+        )
+        QR_CODE_CACHE[qrSettings] = qr
+    else:
+        qr.clear()
+        # make_image may have bumped the version up to fit the previous chunk
+        qr.version = theVersion
     
     #print('version: '+str(qr.version))
-    qr.add_data(data, optimize=0)
+    # our chunks are always bytes and always go in byte mode, so hand it to qrcode as a byte mode segment
+    # rather than have it scan the data to pick a mode
+    qr.add_data(qrcode.util.QRData(data, mode=qrcode.util.MODE_8BIT_BYTE, check_data=False), optimize=0)
     #f = io.StringIO()
     #qr.print_ascii(out=f)
     #f.seek(0)
     #print('qr code length: '+str(len(f.read())))
-    img = qr.make_image(fill_color=fillColor, back_color=backColor)
-    img.save(saveName)
+    # make_image would draw every module as its own rectangle, so the module matrix is scaled up with numpy instead
+    qr.make()
+    return renderQRmatrix(qr.get_matrix(),pixelDensity,fillColor,backColor)
+
+# turns a QR code's matrix of modules (True is dark) into an image with each module pixelDensity pixels wide
+# QR codes only have two colors, so black on white codes are 1 bit per pixel, and any other colors use a two
+# color palette, rather than storing full RGB pixels
+def renderQRmatrix(matrix,pixelDensity,fillColor,backColor):
+    modules = np.array(matrix, dtype=bool)
+    modules = modules.repeat(pixelDensity, axis=0).repeat(pixelDensity, axis=1)
+    if fillColor.lower() == 'black' and backColor.lower() == 'white':
+        return Image.fromarray(~modules)
+    img = Image.fromarray(modules.astype(np.uint8))
+    fill = ImageColor.getcolor(fillColor, 'RGB')
+    if backColor.lower() == 'transparent':
+        img.putpalette( (0,0,0) + fill )
+        img.info['transparency'] = 0
+    else:
+        img.putpalette( ImageColor.getcolor(backColor, 'RGB') + fill )
+    return img
 
 # On a PDF, estimates the width in inches that a QR code can be based on the required empty space around it
 def getImageWidth(pageWidth,perPage,totalOuterMargin,innerMargin,columns):
@@ -592,32 +705,41 @@ def getImageWidth(pageWidth,perPage,totalOuterMargin,innerMargin,columns):
         width = (width - (innerMargin*(columns-1)))/columns
     return width
 
-# function that takes the QR codes generated and cached in a temporary folder and makes a PDF 
-def generateQRpdf(foldername,filename,pagesize,codecount):
+# set the text style for the PDF
+def getParagraphStyle():
+    global PARAGRAPH_STYLE
+    if PARAGRAPH_STYLE is None:
+        from reportlab.lib.styles import ParagraphStyle
+        PARAGRAPH_STYLE = ParagraphStyle(
+            "text_output_style",
+            fontName="Times-Roman",  
+            fontSize=7,  
+            textColor='black'
+        )
+    return PARAGRAPH_STYLE
+
+# function that takes the QR code images generated, as reportlab ImageReaders, and makes a PDF 
+def generateQRpdf(images,filename,pagesize,codecount):
+    from reportlab.pdfgen.canvas import Canvas
+    from reportlab.platypus import Paragraph
+
     def writeTextBlock(filename,index,drawX,drawY):
-        textFileName = filename + '.'+str(index)
-        #print(textFileName)
-        textValue = ''
-        fullfilename = 'TXT_CACHE_TEMP/'+textFileName+'.txt'
-        with open(fullfilename, "r") as t:
-            textValue = t.read()
+        textValue = TEXT_CACHE.pop(filename + '.'+str(index))
         # CLEAN THE TEXT
+        # remove the metadata tags, by moving a cursor past them the same way decodeQRandAppend does, and slicing once
+        pos = 0
+        if textValue.startswith( 'b64:', pos ):
+            pos += len( 'b64:' )
+        if textValue.startswith( ':z:', pos ):
+            pos += len( ':z:' )
+        if textValue.startswith( '::f::', pos ):
+            pos = textValue.index( '::/f::', pos ) + len( '::/f::' )
+        if textValue.startswith( '::c', pos ):
+            pos = textValue.index( '::', pos + len( '::c' ) ) + len( '::' )
         # replace new lines with <br> tags
-        textValue = textValue.replace("\n", "<br/>")
-        # remove the metadata tags
-        if textValue[0 : len( 'b64:' ) ] == 'b64:':
-            textValue = textValue[ len( 'b64:' ) : ]
-        if textValue[0 : len( ':z:' ) ] == ':z:':
-            textValue = textValue[ len( ':z:' ) : ]
-        if textValue[0 : len( '::f::' ) ] == '::f::':
-            textValue = textValue[ textValue.index('::/f::') : ]
-            textValue = textValue[ len( '::/f::' ) : ]
-        if textValue[0 : len( '::c' ) ] == '::c':
-            textValue = textValue[ len( '::c' ) : ]
-            textValue = textValue[ textValue.index('::') : ]
-            textValue = textValue[ len( '::' ) : ]
+        textValue = textValue[ pos : ].replace("\n", "<br/>")
         #style = ParagraphStyle(name='normal')
-        p = Paragraph(textValue, style=PARAGRAPH_STYLE)
+        p = Paragraph(textValue, style=getParagraphStyle())
         textwidth = imageWidth
         if COLUMNS == 1:
             # in a single-column environment, we can make the text width the full width of the page
@@ -639,25 +761,17 @@ def generateQRpdf(foldername,filename,pagesize,codecount):
                 paraY = HEIGHT - (topMargin*2*inch)
         #print(paraY)
         
-        p.wrapOn(canvas, textwidth, imageWidth)
+        # the wrap above has already laid the text out at this width, so it can be drawn straight away
         # Draw the text block at the specified coordinates
         p.drawOn(canvas, drawX, paraY)
         nonlocal pageIndex
         pageIndex +=1 
-        remove(fullfilename)
 
     def drawQR():
-        additional = 0
-        usableWidth = WIDTH - (leftMargin + (MARGIN_RIGHT*inch))-((COLUMNS-1)*internalMargin )
-        if PDF_CODE_ALIGN == 'center':
-            additional = (usableWidth - (COLUMNS*imageWidth))/2/COLUMNS
-        if PDF_CODE_ALIGN == 'right':
-            additional = (usableWidth/COLUMNS)-imageWidth
-
-        canvas.drawImage(thisFile,currentDrawX+additional,HEIGHT - currentDrawY - imageWidth - PDF_BODY_FONT_SIZE,imageWidth,imageWidth)
         nonlocal pageIndex
-        pageIndex +=1  
         nonlocal index
+        canvas.drawImage(images[index],currentDrawX+additional,HEIGHT - currentDrawY - imageWidth - PDF_BODY_FONT_SIZE,imageWidth,imageWidth,mask='auto')
+        pageIndex +=1  
         index += 1
         
     def incrementColumn():
@@ -675,7 +789,6 @@ def generateQRpdf(foldername,filename,pagesize,codecount):
         nonlocal currentDrawX
         currentDrawX = leftMargin
 
-    stopThePresses = False
     codesPerPage = CODES_PER_PAGE
     topMargin = MARGIN_TOP * inch
     leftMargin = MARGIN_LEFT * inch
@@ -684,6 +797,16 @@ def generateQRpdf(foldername,filename,pagesize,codecount):
     
     WIDTH = pagesize[0]
     HEIGHT = pagesize[1]
+    # how far each QR code is shifted right within its column to align it. This is the same for every code
+    additional = 0
+    usableWidth = WIDTH - (leftMargin + (MARGIN_RIGHT*inch))-((COLUMNS-1)*internalMargin )
+    if PDF_CODE_ALIGN == 'center':
+        additional = (usableWidth - (COLUMNS*imageWidth))/2/COLUMNS
+    if PDF_CODE_ALIGN == 'right':
+        additional = (usableWidth/COLUMNS)-imageWidth
+    # the index labels sit a quarter of the font size above the top of each row
+    labelOffset = PDF_BODY_FONT_SIZE/4
+    labels = [ str(labelIndex+1) +'/'+str(codecount) for labelIndex in range(codecount) ]
 
     currentDrawY = topMargin
     currentDrawX = leftMargin
@@ -699,99 +822,77 @@ def generateQRpdf(foldername,filename,pagesize,codecount):
     #print headline
     canvas.setFont(PDF_HEADER_FONT, PDF_HEADER_FONT_SIZE)
     canvas.drawString( leftMargin , HEIGHT-topMargin-(PDF_HEADER_FONT_SIZE/2), filename)
+    # the index labels are all in the body font, so it only needs setting once per page, after the headline
+    canvas.setFont(PDF_BODY_FONT,PDF_BODY_FONT_SIZE)
     #Start drawing the QR codes below the headline
     currentDrawY = topMargin+PDF_HEADER_FONT_SIZE+topMargin
     pageCount = 1
     while index < codecount:
-        thisFile = foldername+filename+'.'+str(index)+'.png'
-        if path.exists( thisFile ):
-            print('Adding to PDF: '+thisFile)
-            #print label for image
-            canvas.setFont(PDF_BODY_FONT,PDF_BODY_FONT_SIZE)
-            # draw the index label for this QR code
-            canvas.drawString(currentDrawX, HEIGHT - currentDrawY+(PDF_BODY_FONT_SIZE/4) , str(index+1) +'/'+str(codecount))
-            # set current row below label
-            currentDrawY = currentDrawY
-            # are we drawing text or a QR code?
-            if PDF_INCLUDE_TXT == '' or PDF_INCLUDE_TXT == None:
-                # draw the QR code
-                drawQR()
-            elif PDF_INCLUDE_TXT == 'left':
-                # draw the text and increment the columnIndex and currentDrawX, then draw the QR code
-                writeTextBlock(filename,index,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
-                incrementColumn()
-                drawQR()
-            elif PDF_INCLUDE_TXT == 'right':
-                # draw the QR code, and increment the columnIndex and currentDrawX, then draw the text
-                drawQR()
-                incrementColumn()
-                writeTextBlock(filename,index-1,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
-            elif PDF_INCLUDE_TXT == 'top':
-                writeTextBlock(filename,index,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
-                tempY = currentDrawY
-                currentDrawY = currentDrawY + internalMargin + imageWidth
-                drawQR()
-                currentDrawY = tempY
-            elif PDF_INCLUDE_TXT == 'bottom':
-                drawQR()
-                tempY = currentDrawY
-                currentDrawY = currentDrawY + internalMargin + imageWidth
-                writeTextBlock(filename,index-1,currentDrawX,currentDrawY)
-                currentDrawY = tempY
+        print('Adding to PDF: '+filename+'.'+str(index))
+        # draw the index label for this QR code
+        canvas.drawString(currentDrawX, HEIGHT - currentDrawY + labelOffset , labels[index])
+        # are we drawing text or a QR code?
+        if PDF_INCLUDE_TXT == '' or PDF_INCLUDE_TXT == None:
+            # draw the QR code
+            drawQR()
+        elif PDF_INCLUDE_TXT == 'left':
+            # draw the text and increment the columnIndex and currentDrawX, then draw the QR code
+            writeTextBlock(filename,index,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
             incrementColumn()
-            if pageIndex >= codesPerPage and index < codecount:
-                #create a new page and redraw the headline, reset margins
-                pageCount += 1
-                print('Starting page '+str(pageCount) )
-                pageIndex = 0
-                columnIndex = 0
-                canvas.showPage()
-                currentDrawY = topMargin
-                currentDrawX = leftMargin
-                canvas.setFont(PDF_HEADER_FONT, PDF_HEADER_FONT_SIZE)
-                canvas.drawCentredString( WIDTH/2 , HEIGHT-topMargin-(PDF_HEADER_FONT_SIZE/2), filename)
-                currentDrawY = topMargin+PDF_HEADER_FONT_SIZE+topMargin
-            #check to see if we've drawn the second QR code on this row, 
-            # and if so move to next row
-            elif columnIndex >= COLUMNS:
-                incrementRow()
-        else:
-            print('\nSTOP THE PRESSES! Couldn\'t find file with index '+str(index))
-            stopThePresses = True
-            index = codecount
-    if PDF_INCLUDE_TXT:
-        rmdir('TXT_CACHE_TEMP')
-    if stopThePresses == False:
-        canvas.save()
+            drawQR()
+        elif PDF_INCLUDE_TXT == 'right':
+            # draw the QR code, and increment the columnIndex and currentDrawX, then draw the text
+            drawQR()
+            incrementColumn()
+            writeTextBlock(filename,index-1,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
+        elif PDF_INCLUDE_TXT == 'top':
+            writeTextBlock(filename,index,currentDrawX,currentDrawY + PDF_BODY_FONT_SIZE)
+            tempY = currentDrawY
+            currentDrawY = currentDrawY + internalMargin + imageWidth
+            drawQR()
+            currentDrawY = tempY
+        elif PDF_INCLUDE_TXT == 'bottom':
+            drawQR()
+            tempY = currentDrawY
+            currentDrawY = currentDrawY + internalMargin + imageWidth
+            writeTextBlock(filename,index-1,currentDrawX,currentDrawY)
+            currentDrawY = tempY
+        incrementColumn()
+        if pageIndex >= codesPerPage and index < codecount:
+            #create a new page and redraw the headline, reset margins
+            pageCount += 1
+            print('Starting page '+str(pageCount) )
+            pageIndex = 0
+            columnIndex = 0
+            canvas.showPage()
+            currentDrawY = topMargin
+            currentDrawX = leftMargin
+            canvas.setFont(PDF_HEADER_FONT, PDF_HEADER_FONT_SIZE)
+            canvas.drawCentredString( WIDTH/2 , HEIGHT-topMargin-(PDF_HEADER_FONT_SIZE/2), filename)
+            canvas.setFont(PDF_BODY_FONT,PDF_BODY_FONT_SIZE)
+            currentDrawY = topMargin+PDF_HEADER_FONT_SIZE+topMargin
+        #check to see if we've drawn the second QR code on this row, 
+        # and if so move to next row
+        elif columnIndex >= COLUMNS:
+            incrementRow()
+    canvas.save()
         
 
-# takes a text blob and saves a .txt file. Used to cache for pdfs that render text alongside the QR code
-def saveDataAsTXT(outFileName,data):
-    #print('saving...'+outFileName)
-    if not path.exists('TXT_CACHE_TEMP'):
-        mkdir('TXT_CACHE_TEMP')
-    if "\\" in outFileName:
-        outFileName.split("\\")[-1]
-    if "/" in outFileName:
-        outFileName.split("/")[-1]
-    #print('writing.... TXT_CACHE_TEMP/'+outFileName+'.txt')
-    with open('TXT_CACHE_TEMP/'+outFileName+'.txt', "x") as t:
-        print(data,file=t)
-        t.close()
-
-
 ################################################################################################################
                                         # LOADING FUNCTIONS
 ################################################################################################################
 
 # reads a series of QR codes from camera shots
 def readFromCamera(outFileName):
+    import cv2
     print('\nPlace first QR code in front of the camera. Be sure to cover or keep off frame any other QR codes\n')
     cap = cv2.VideoCapture(0)
     font = cv2.FONT_HERSHEY_PLAIN
     isAnotherFile = True
-    out = qrCodeOutput(False,outFileName,'')
+    out = qrCodeOutput(False,outFileName,[])
     index = 0
+    # the data of the last code we accepted, so it isn't read again while it is still in front of the camera
+    acceptedQr = None
     while isAnotherFile:
         print( '\nScanning for image '+str(index) )
         found = False
@@ -801,22 +902,29 @@ def readFromCamera(outFileName):
         frameC = 0
         while found == False:
             _, frame = cap.read()
-            decodedObjects = pyzbar.decode(frame)
             frameC += 1
-            for qr in decodedObjects:
-                print("\a")
-                cv2.putText(frame, str(qr.data), (50, 50), font, 2,
-                        (255, 0, 0), 3)
-                if len(str(qr.data)) and frameC > 200:
-                    outWithNew = decodeQRandAppend(qr,out,index,True)
-                    found = True
-                    frameC = 0
+            # decoding is the slow part, so only do it every few frames, on a frame no bigger than it needs to be
+            if frameC % CAMERA_DECODE_INTERVAL == 0:
+                decodedObjects = decodeQRcodes(shrinkFrame(frame))
+                for qr in decodedObjects:
+                    if not len(qr.data) or qr.data == acceptedQr:
+                        continue
+                    print("\a")
+                    cv2.putText(frame, str(qr.data), (50, 50), font, 2,
+                            (255, 0, 0), 3)
+                    # wait until the same code is read twice in a row, so we know it is held steady
+                    if qr.data == lastQr:
+                        outWithNew = decodeQRandAppend(qr,out,index,True)
+                        acceptedQr = qr.data
+                        found = True
+                        break
+                    lastQr = qr.data
             cv2.imshow("Frame", frame)
 
             key = cv2.waitKey(1)
             if key == 27:
                 found = True
-        if outWithNew.finalOutputString is not None:
+        if outWithNew is not None:
             out = outWithNew
             more = ''
             while more != 'Y' and more != 'N':
@@ -831,66 +939,139 @@ def readFromCamera(outFileName):
             isAnotherFile = True
     writeOutputFile(out)
 
+# scales a camera frame down to at most CAMERA_MAX_DECODE_HEIGHT pixels tall before it is decoded
+def shrinkFrame(frame):
+    import cv2
+    height = frame.shape[0]
+    if height <= CAMERA_MAX_DECODE_HEIGHT:
+        return frame
+    scale = CAMERA_MAX_DECODE_HEIGHT / height
+    return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
 # reads a series of QR code png files
 def readFromPNG(fileName,outFileName):
     if fileName == None :
         fileName = input('\nFile to read: ')
-    isAnotherFile = True
-    index = 0
-    out = qrCodeOutput(False,outFileName,'')
-    while isAnotherFile:
-        if path.exists( fileName+'.'+str(index)+'.png' ):
-            firstFile = cv2.imread(fileName+'.'+str(index)+'.png')
-            decoded = pyzbar.decode(firstFile)
-            for qr in decoded:
-                out = decodeQRandAppend(qr,out,index,False)
-        else:
-            if index == 0:
-                print('\nFile "{}" does not exist'.format(fileName) )
+    # find every image in the series before decoding any of them, listing the directory once rather than
+    # checking for each numbered file in turn
+    # glob may spell the directory or the case of the name differently from what was typed, so only the part
+    # of each name after the prefix is checked for the index
+    imageIndexes = {}
+    prefixLength = len( path.basename(fileName) )
+    for imagePath in glob.glob( glob.escape(fileName)+'.*.png' ):
+        match = re.fullmatch( r'\.(\d+)\.png', path.basename(imagePath)[prefixLength:] )
+        if match:
+            imageIndexes[ int(match.group(1)) ] = imagePath
+    # the series runs from index 0 until the first missing number
+    imagePaths = []
+    while len(imagePaths) in imageIndexes:
+        imagePaths.append( imageIndexes[ len(imagePaths) ] )
+    if len(imagePaths) == 0:
+        print('\nFile "{}" does not exist'.format(fileName) )
+        exit( 1 )
+    # cv2 releases the GIL while it works, so the images can be decoded in parallel threads
+    with ThreadPoolExecutor() as executor:
+        decodedImages = list( executor.map(decodeImageFile,imagePaths) )
+    # then put the decoded data together in order
+    out = qrCodeOutput(False,outFileName,[])
+    # a code that can't be read, or is out of order, would leave a hole in the file, so stop rather than write it
+    for index, decoded in enumerate(decodedImages):
+        if not decoded:
+            print('***Error*** Could not read a QR code from '+imagePaths[index]+'. No file was written.')
+            exit( 1 )
+        for qr in decoded:
+            out = decodeQRandAppend(qr,out,index,False)
+            if out is None:
+                print('***Error*** The QR code in '+imagePaths[index]+' is not number '+str(index)+' in the series. No file was written.')
                 exit( 1 )
-            isAnotherFile = False
-        index += 1
     writeOutputFile(out)
 
+# loads an image file and returns the QR codes found in it
+def decodeImageFile(imagePath):
+    return decodeQRcodes( readImage(imagePath) )
+
+# finds and decodes the QR codes in an image, returning objects with the raw data in .data, like pyzbar does
+# pyzbar reads all of the codes we make, so it is tried first. OpenCV's own detector can't read some of them, so it
+# is only used when the zbar library isn't installed, or pyzbar finds nothing
+def decodeQRcodes(image):
+    pyzbar = getPyzbar()
+    if pyzbar:
+        decoded = pyzbar.decode(image)
+        if decoded:
+            return decoded
+    import cv2
+    # the aruco-based detector, in OpenCV 4.8 and up, reads the large, dense codes we make far more reliably
+    if hasattr(cv2, 'QRCodeDetectorAruco'):
+        detector = cv2.QRCodeDetectorAruco()
+    else:
+        detector = cv2.QRCodeDetector()
+    found, decodedStrings, points, straightCodes = detector.detectAndDecodeMulti(image)
+    decoded = []
+    if found:
+        decoded = [ decodedQRcode(text.encode('utf-8')) for text in decodedStrings if text ]
+    return decoded
+
+# imports pyzbar the first time it is needed, and remembers if it isn't available
+def getPyzbar():
+    global PYZBAR
+    if PYZBAR is None:
+        try:
+            from pyzbar import pyzbar
+            PYZBAR = pyzbar
+        except ImportError:
+            PYZBAR = False
+    return PYZBAR
+
+# loads an image file into an array that can be decoded
+def readImage(imagePath):
+    import cv2
+    if pyvips is not None:
+        img = pyvips.Image.new_from_file(imagePath, access='sequential')
+        return np.ndarray(buffer=img.write_to_memory(), dtype=np.uint8, shape=[img.height, img.width, img.bands])
+    return cv2.imread(imagePath)
+
 #decodes a provided QR code and appends it to the existing "out" object
 #also figures out the filename and binary/text status if provided in the first QR code
+#returns None if the user chooses to rescan the code, or if a code read from a file is out of order
 def decodeQRandAppend(qr,out,index,fromCamera):
     global ZIP_DECODE
 
-    if out.finalOutputString is None:
-        out.finalOutputString = ''
     print('Decoding QR code '+str(index))
-    data = qr.data.decode("utf-8")
+    # the data stays as bytes. Only the file name is decoded, and the rest is decoded as the file is written
+    data = qr.data
+    # move a cursor past the metadata tags at the start of the data rather than slicing each one off
+    pos = 0
     count = 0
-    if index == 0 and data[0 : len( 'b64:' ) ] == 'b64:':
+    if index == 0 and data.startswith( b'b64:', pos ):
         print('Outputting a binary file')
         out.isBinaryFile = True
-        data = data[ len( 'b64:' ) : ]
-    if index == 0 and data[0 : len( ':z:' ) ] == ':z:':
+        pos += len( 'b64:' )
+    if index == 0 and data.startswith( b':z:', pos ):
         print('QR code series contains Zip archive to unzip.')
-        data = data[ len( ':z:' ) : ]
+        pos += len( ':z:' )
         ZIP_DECODE = True
     if index == 0:
-        if data[0 : len( '::f::' ) ] == '::f::':
-            data = data[ len( '::f::' ) : ]
-            extractedFileName = data[ 0 : data.index('::/f::') ]
+        if data.startswith( b'::f::', pos ):
+            pos += len( b'::f::' )
+            fileNameEnd = data.index( b'::/f::', pos )
+            extractedFileName = data[ pos : fileNameEnd ].decode('utf-8')
             if out.outFileName is None or out.outFileName == '':
                 out.outFileName = extractedFileName
                 print('Using filename "'+extractedFileName+'"')
             else:
                 ext = getextension(extractedFileName)
                 out.outFileName = out.outFileName + ext
-            data = data[len(extractedFileName) : ]
-            data = data[ len( '::/f::' ) : ]
+            pos = fileNameEnd + len( b'::/f::' )
     countMatch = True
     noCount = False
-    if data[0 : len( '::c' ) ] == '::c':
-        data = data[len('::c') : ]
-        count = int(data[0 : data.index('::') ])
+    if data.startswith( b'::c', pos ):
+        pos += len( b'::c' )
+        countEnd = data.index( b'::', pos )
+        count = int( data[ pos : countEnd ] )
         print('Found count '+str(count))
         if count != index:
             countMatch = False
-        data = data[ len( str(count) )+len('::') : ]
+        pos = countEnd + len( b'::' )
     else:
         noCount = True
         print('No count found')
@@ -903,9 +1084,11 @@ def decodeQRandAppend(qr,out,index,fromCamera):
                 print('The scanned QR code does not contain an index, so we can\'t be sure you scanned them in order.')
             accept = input('Would you like to (A)ccept this code or (R)escan QR code'+str(index)+'? \n A/R : ')
         if accept == 'R':
-            out.finalOutputString = None
-            return out
-    out.finalOutputString = out.finalOutputString + data
+            return None
+    if countMatch == False and not fromCamera:
+        return None
+    # the decoded pieces are collected in a list and only joined together when the file is written
+    out.finalOutputString.append( data[ pos : ] )
     return out
 
 # saves the file retrieved from the QR codes to the computer
@@ -914,16 +1097,29 @@ def writeOutputFile(out):
 
     if out.isBinaryFile:
         readMethod = 'wb'
-        output = b64decode(out.finalOutputString)
     else:
         readMethod = 'w'
-        output = out.finalOutputString
     if out.outFileName == '':
         out.outFileName = 'unknownfile.txt'
     if ZIP_DECODE:
         out.outFileName = out.outFileName + '.zip'
+    # write the file out one QR code's worth at a time, so the whole of it is never held in memory twice
     with open( out.outFileName, readMethod ) as f:
-        f.write( output )
+        if out.isBinaryFile:
+            # Base64 decodes in groups of 4 characters, so carry any left over on to the next piece
+            leftover = b''
+            for piece in out.finalOutputString:
+                piece = leftover + piece
+                wholeGroups = len(piece) - len(piece) % 4
+                f.write( b64decode( piece[ : wholeGroups ] ) )
+                leftover = piece[ wholeGroups : ]
+            f.write( b64decode( leftover ) )
+        else:
+            # a character may be split across two QR codes, so decode the text as one stream
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            for piece in out.finalOutputString:
+                f.write( decoder.decode(piece) )
+            f.write( decoder.decode(b'', final=True) )
     if ZIP_DECODE:
         shutil.unpack_archive(out.outFileName)
         remove(out.outFileName)
@@ -936,53 +1132,20 @@ def writeOutputFile(out):
     
 # this returns the version number of the QR code protocol that is needed given the 
 # size of the data being saved
-def getVersionFromChunk(chunk):
-    if DEBUG_LEVEL == qrcode.constants.ERROR_CORRECT_H:
-        modifier = 0.4
-    elif DEBUG_LEVEL == qrcode.constants.ERROR_CORRECT_M:
-        modifier = 0.75
-    else:
-        modifier = 1
-    if(chunk <= 106*modifier):
-        return 5
-    if(chunk <= 271*modifier):
-        return 10
-    if(chunk <= 520*modifier):
-        return 15
-    elif(chunk <= 858*modifier):
-        return 20
-    if(chunk <= 1273*modifier):
-        return 25
-    elif(chunk <= 1732*modifier):
-        return 30
-    elif(chunk <= 2303*modifier):
-        return 35
-    else:
-        return 40
-
-# detects if the input file, which is text, contains non-ascii characters
-def isAscii(input_string):
-    for char in input_string:
-        if ord(char) > 127:
-            return False
-    return True
-
-# lowers the chunk size to the next lowest level
-def reduceChunkSize(chunk):
-    if chunk >= 2953:
-        return 2303
-    elif  chunk >= 2303:
-        return 1732
-    elif  chunk >= 1732:
-        return 1273
-    elif  chunk >= 1273:
-        return 858
-    elif  chunk >= 858: 
-        return 520
-    elif  chunk >= 520:
-        return 271
-    else: 
-        return 106
+def getVersionFromChunk(chunk,debugLevel=None):
+    if debugLevel is None:
+        debugLevel = DEBUG_LEVEL
+    thresholds = QR_VERSION_THRESHOLDS.get(debugLevel, QR_VERSION_CAPACITIES)
+    return QR_VERSIONS[ bisect_left(thresholds, chunk) ]
+
+# guesses whether the contents of a file are binary rather than text, from its first 8kb
+# null bytes, or more than a few control characters other than whitespace, mean it is binary
+def isBinary(input_bytes):
+    sample = input_bytes[:8192]
+    if b'\x00' in sample:
+        return True
+    controlCharacters = sum( 1 for byte in sample if byte < 8 or 13 < byte < 32 )
+    return controlCharacters > len(sample) // 10
 
 def generateFileName(filename,current,outputCount):
     out = filename + '.'+str(current)
@@ -1017,8 +1180,8 @@ def validateUserInput():
         
 
 
-def welcomeGraphic():
-    out = '''
+# the banner printed when the program starts
+WELCOME_GRAPHIC = '''
 
  #####  ######     ######                     ######                         
 #     # #     #    #     # #  ####  #    #    #     # #####  # #    # ###### 
@@ -1042,7 +1205,9 @@ def welcomeGraphic():
          █▄▄▄▄▄█ ██▀▀▀█▄█▀█▀▄         |___|___|________|___|
          
          '''
-    return out
+
+def welcomeGraphic():
+    return WELCOME_GRAPHIC
 
 if __name__ == "__main__":
     main()
\ No newline at end of file